@@ -36,9 +36,9 @@ DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'mqtt_data.db')
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 LOG_FILE = os.path.join(os.path.dirname(__file__), 'mqtt_client.log')
 
-# Reconnection Configuration
+# Reconnection Configuration (exponential backoff between these bounds)
 RECONNECT_DELAY = 5  # seconds
-MAX_RECONNECT_ATTEMPTS = 10
+MAX_RECONNECT_DELAY = 120  # seconds
 
 # Message payload format expectations
 # Messages should be JSON formatted
@@ -5,25 +5,105 @@ Creates SQLite database with necessary tables for storing device data.
 
 import sqlite3
 import os
-from datetime import datetime
+import queue
+import threading
+import time
+from datetime import datetime, timezone
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'mqtt_data.db')
 
+# Shared connection for schema setup and queries, reused instead of reopening the
+# file per call. Opened on first use and guarded by _lock since it is shared
+# across threads. Inserts go through the writer thread's own connection.
+_conn = None
+_lock = threading.Lock()
+
+# Insert statements kept as constants so the connection's statement cache
+# reuses the prepared statement instead of re-parsing the SQL per message.
+_SQL_INS_TEMP = '''
+    INSERT INTO temperature_logs (device_id, temperature, humidity, status, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+'''
+_SQL_INS_POWER = '''
+    INSERT INTO power_status_logs (device_id, ebstatus, dgstatus, timestamp)
+    VALUES (?, ?, ?, ?)
+'''
+_SQL_INS_FP = '''
+    INSERT INTO fingerprint_logs (device_id, user_id, auth_status, timestamp)
+    VALUES (?, ?, ?, ?)
+'''
+_INSERT_SQL = {
+    'temp': _SQL_INS_TEMP,
+    'power': _SQL_INS_POWER,
+    'fp': _SQL_INS_FP,
+}
+
+# Inserts are queued and written by a single writer thread that groups them
+# into one transaction (one fsync) per batch of up to WRITE_BATCH_SIZE rows
+# or WRITE_BATCH_WAIT seconds, whichever comes first.
+WRITE_BATCH_SIZE = 500
+WRITE_BATCH_WAIT = 0.05  # seconds
+_write_queue = queue.Queue(maxsize=10000)
+_writer = None
+_STOP = object()
+
+# Rows dropped because the write queue was full, per table kind. The writer
+# thread reports and resets the counts once per batch instead of the caller
+# printing a line for every dropped row.
+_dropped = {}
+_dropped_lock = threading.Lock()
+
+# How often the writer thread runs PRAGMA optimize; it also runs on shutdown
+OPTIMIZE_INTERVAL = 600  # seconds
+
+# Range of integers SQLite can bind
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+# Query results are handed out in lists of at most this many rows
+FETCH_CHUNK_SIZE = 512
+
+# Data columns of each log table, used to copy rows out of tables created
+# with the old TEXT timestamp and date columns
+_LEGACY_TABLES = {
+    'temperature_logs': 'device_id, temperature, humidity, status',
+    'power_status_logs': 'device_id, ebstatus, dgstatus',
+    'fingerprint_logs': 'device_id, user_id, auth_status',
+}
+
 
 def create_connection():
     """Create a database connection to SQLite."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                               cached_statements=64)
+        # Connection-scoped tuning: WAL makes synchronous=NORMAL safe and drops
+        # the fsync per commit; mmap and a 64 MiB page cache keep reads in memory.
+        conn.executescript('''
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-65536;
+        ''')
         return conn
     except sqlite3.Error as e:
         print(f"Database connection error: {e}")
         return None
 
 
+def get_conn():
+    """Return the shared database connection, opening it on first use."""
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                _conn = create_connection()
+    return _conn
+
+
 def init_database():
     """Initialize the database with necessary tables."""
-    conn = create_connection()
+    conn = get_conn()
     if conn is None:
         print("Failed to create database connection")
         return False
@@ -31,212 +111,425 @@ def init_database():
     cursor = conn.cursor()
 
     try:
+        # Write-ahead logging is persistent in the database file
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+        cursor.execute('BEGIN')
+
+        # Timestamps are stored as INTEGER unix epoch seconds (UTC) rather than
+        # ISO text, roughly halving row and index size. Tables still in the old
+        # layout are moved aside here and their rows copied over below.
+        legacy = [table for table in _LEGACY_TABLES if _has_column(cursor, table, 'date')]
+        for table in legacy:
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_legacy')
+
         # Temperature and Humidity logs table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS temperature_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 device_id TEXT NOT NULL,
                 temperature REAL NOT NULL,
                 humidity REAL NOT NULL,
                 status TEXT NOT NULL DEFAULT '',
-                timestamp DATETIME NOT NULL,
-                date TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                timestamp INTEGER NOT NULL,
+                created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )
         ''')
 
         # Power status logs table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS power_status_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 device_id TEXT NOT NULL,
                 ebstatus TEXT NOT NULL,
                 dgstatus TEXT NOT NULL,
-                timestamp DATETIME NOT NULL,
-                date TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                timestamp INTEGER NOT NULL,
+                created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )
         ''')
 
         # Fingerprint authentication logs table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS fingerprint_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER PRIMARY KEY,
                 device_id TEXT NOT NULL,
                 user_id TEXT NOT NULL,
                 auth_status TEXT NOT NULL,
-                timestamp DATETIME NOT NULL,
-                date TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                timestamp INTEGER NOT NULL,
+                created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )
         ''')
 
-        # Create indexes for faster queries
+        for table in legacy:
+            _copy_legacy_rows(cursor, table)
+
+        # Covering indexes for the date queries: rows are looked up by device
+        # and created_at range and returned in created_at order straight from
+        # the index, with no table lookup or separate sort step
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_temp_device_date 
-            ON temperature_logs(device_id, date)
+            CREATE INDEX IF NOT EXISTS idx_temp_device_created
+            ON temperature_logs(device_id, created_at, temperature, humidity, status)
         ''')
 
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_power_device_date 
-            ON power_status_logs(device_id, date)
+            CREATE INDEX IF NOT EXISTS idx_power_device_created
+            ON power_status_logs(device_id, created_at, ebstatus, dgstatus)
         ''')
 
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_fingerprint_device_date 
-            ON fingerprint_logs(device_id, date)
+            CREATE INDEX IF NOT EXISTS idx_fingerprint_device_created
+            ON fingerprint_logs(device_id, created_at, user_id, auth_status)
         ''')
 
-        conn.commit()
-        print("Database initialized successfully")
-        return True
+        cursor.execute('COMMIT')
 
     except sqlite3.Error as e:
         print(f"Database initialization error: {e}")
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
         return False
-    finally:
-        conn.close()
 
+    if not start_writer():
+        return False
+
+    print("Database initialized successfully")
+    return True
+
+
+def _has_column(cursor, table, column):
+    """Check whether an existing table has the given column."""
+    return any(row[1] == column for row in cursor.execute(f'PRAGMA table_info({table})'))
+
+
+def _copy_legacy_rows(cursor, table):
+    """Copy rows from a renamed old-layout table into its replacement and drop it.
+
+    TEXT timestamps are converted to epoch seconds; rows whose device timestamp
+    cannot be parsed fall back to the time they were received.
+    """
+    columns = _LEGACY_TABLES[table]
+    cursor.execute(f'''
+        INSERT INTO {table} (id, {columns}, timestamp, created_at)
+        SELECT id, {columns},
+               COALESCE(CAST(strftime('%s', timestamp) AS INTEGER),
+                        CAST(strftime('%s', created_at) AS INTEGER), 0),
+               COALESCE(CAST(strftime('%s', created_at) AS INTEGER), 0)
+        FROM {table}_legacy
+    ''')
+    cursor.execute(f'DROP TABLE {table}_legacy')
+
+
+def start_writer():
+    """Start the background writer thread with its own connection."""
+    global _writer
+    if _writer is not None:
+        return True
 
-def insert_temperature_log(device_id, temperature, humidity, status, timestamp):
-    """Insert temperature and humidity log."""
     conn = create_connection()
     if conn is None:
+        print("Failed to create writer connection")
         return False
 
+    _writer = threading.Thread(target=_writer_loop, args=(conn,),
+                               name='sqlite-writer', daemon=True)
+    _writer.start()
+    return True
+
+
+def _writer_loop(conn):
+    """Drain the write queue, committing each batch in a single transaction."""
+    # Per-table buffers so each batch is written with one executemany() per table
+    buffers = {kind: [] for kind in _INSERT_SQL}
+    last_optimize = time.monotonic()
+    stopping = False
     try:
-        cursor = conn.cursor()
-        date = timestamp.split('T')[0] if 'T' in timestamp else timestamp.split(' ')[0]
-        
-        cursor.execute('''
-            INSERT INTO temperature_logs (device_id, temperature, humidity, status, timestamp, date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (device_id, temperature, humidity, status, timestamp, date))
-        
-        conn.commit()
-        return True
-    except sqlite3.Error as e:
-        print(f"Error inserting temperature log: {e}")
-        return False
+        while not stopping:
+            item = _write_queue.get()
+            pending = 0
+            deadline = time.monotonic() + WRITE_BATCH_WAIT
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                kind, row = item
+                buffers[kind].append(row)
+                pending += 1
+                remaining = deadline - time.monotonic()
+                if pending >= WRITE_BATCH_SIZE or remaining <= 0:
+                    break
+                try:
+                    item = _write_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            try:
+                if pending:
+                    _write_batch(conn, buffers, pending)
+                _report_dropped()
+
+                # Refresh query planner statistics as the log tables grow
+                now = time.monotonic()
+                if now - last_optimize >= OPTIMIZE_INTERVAL:
+                    _optimize(conn)
+                    last_optimize = now
+            except Exception as e:
+                # The writer must outlive any single bad batch, or every later row
+                # would be queued and never written
+                print(f"Unexpected error in database writer: {e!r}")
+                try:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                for rows in buffers.values():
+                    rows.clear()
     finally:
+        # Runs on every exit, including the stop requested by close_database()
+        # from the SIGINT/SIGTERM shutdown path
+        _optimize(conn)
         conn.close()
 
 
-def insert_power_status_log(device_id, ebstatus, dgstatus, timestamp):
-    """Insert power status log."""
-    conn = create_connection()
-    if conn is None:
-        return False
+def _report_dropped():
+    """Print how many rows were dropped on a full queue since the last report."""
+    if not _dropped:
+        return
+    with _dropped_lock:
+        counts = dict(_dropped)
+        _dropped.clear()
+    summary = ', '.join(f"{count} {kind}" for kind, count in counts.items())
+    print(f"Write queue full, dropped logs: {summary}")
 
+
+def _optimize(conn):
+    """Run PRAGMA optimize, which only re-analyzes tables when it is worthwhile."""
     try:
-        cursor = conn.cursor()
-        date = timestamp.split('T')[0] if 'T' in timestamp else timestamp.split(' ')[0]
-        
-        cursor.execute('''
-            INSERT INTO power_status_logs (device_id, ebstatus, dgstatus, timestamp, date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (device_id, ebstatus, dgstatus, timestamp, date))
-        
-        conn.commit()
-        return True
+        conn.execute('PRAGMA optimize')
     except sqlite3.Error as e:
-        print(f"Error inserting power status log: {e}")
-        return False
+        print(f"Error optimizing database: {e}")
+
+
+def _write_batch(conn, buffers, pending):
+    """Insert the buffered rows in one transaction and clear the buffers.
+
+    If the batch fails it is retried row by row, so a single bad row only
+    loses itself rather than every row queued alongside it.
+    """
+    try:
+        conn.execute('BEGIN')
+        for kind, rows in buffers.items():
+            if rows:
+                conn.executemany(_INSERT_SQL[kind], rows)
+        conn.execute('COMMIT')
+    except (sqlite3.Error, OverflowError) as e:
+        print(f"Error writing batch of {pending} logs, retrying row by row: {e}")
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        _write_rows(conn, buffers)
     finally:
-        conn.close()
+        for rows in buffers.values():
+            rows.clear()
 
 
-def insert_fingerprint_log(device_id, user_id, auth_status, timestamp):
-    """Insert fingerprint authentication log."""
-    conn = create_connection()
-    if conn is None:
+def _write_rows(conn, buffers):
+    """Insert the buffered rows one at a time, dropping and logging those that fail."""
+    try:
+        conn.execute('BEGIN')
+        for kind, rows in buffers.items():
+            sql = _INSERT_SQL[kind]
+            for row in rows:
+                # A failed INSERT only undoes itself, not the open transaction
+                try:
+                    conn.execute(sql, row)
+                except (sqlite3.Error, OverflowError) as e:
+                    print(f"Dropping {kind} log {row!r}: {e}")
+        conn.execute('COMMIT')
+    except sqlite3.Error as e:
+        print(f"Error writing logs row by row: {e}")
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+
+
+def close_database():
+    """Flush queued rows, stop the writer thread and close the connections."""
+    global _writer, _conn
+    if _writer is not None:
+        # A writer that died can no longer drain the queue, so putting _STOP
+        # on a full queue would block forever
+        if _writer.is_alive():
+            _write_queue.put(_STOP)
+            _writer.join()
+        _writer = None
+
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def _enqueue(kind, row):
+    """Hand a row to the writer thread without blocking the caller.
+
+    When the queue is full (the disk cannot keep up) the row is dropped so
+    that the MQTT network loop is never stalled by SQLite; drops are counted
+    and reported by the writer thread.
+    """
+    if _writer is None or not _writer.is_alive():
         return False
 
     try:
-        cursor = conn.cursor()
-        date = timestamp.split('T')[0] if 'T' in timestamp else timestamp.split(' ')[0]
-        
-        cursor.execute('''
-            INSERT INTO fingerprint_logs (device_id, user_id, auth_status, timestamp, date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (device_id, user_id, auth_status, timestamp, date))
-        
-        conn.commit()
+        _write_queue.put_nowait((kind, row))
         return True
-    except sqlite3.Error as e:
-        print(f"Error inserting fingerprint log: {e}")
+    except queue.Full:
+        with _dropped_lock:
+            _dropped[kind] = _dropped.get(kind, 0) + 1
         return False
-    finally:
-        conn.close()
+
+
+def _to_epoch(timestamp):
+    """Convert an ISO timestamp to epoch seconds, treating naive times as UTC.
+
+    Timestamps that cannot be parsed fall back to the receive time, like
+    _copy_legacy_rows does; queries filter on created_at, so the reading is
+    still worth keeping.
+    """
+    # fromisoformat only accepts a 'Z' suffix from Python 3.11
+    if isinstance(timestamp, str) and timestamp[-1:] in ('Z', 'z'):
+        timestamp = timestamp[:-1] + '+00:00'
+    try:
+        dt = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        print(f"Unparseable timestamp {timestamp!r}, storing receive time instead")
+        return int(time.time())
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _day_bounds(date):
+    """Return the [start, end) epoch seconds of a YYYY-MM-DD date in UTC."""
+    start = int(datetime.fromisoformat(date).replace(tzinfo=timezone.utc).timestamp())
+    return start, start + 86400
+
+
+def _check_scalar(kind, **fields):
+    """Return True if every field is a str or number, printing the first one that is not.
+
+    JSON objects and arrays cannot be bound as SQL parameters, nor can ints
+    outside SQLite's signed 64-bit range; catching them here keeps them out
+    of the writer's batches.
+    """
+    for name, value in fields.items():
+        if not isinstance(value, (str, int, float)) or (
+                isinstance(value, int) and not _INT64_MIN <= value <= _INT64_MAX):
+            print(f"Invalid {kind} {name}: {value!r}")
+            return False
+    return True
+
+
+def insert_temperature_log(device_id, temperature, humidity, status, timestamp):
+    """Queue a temperature and humidity log for the writer thread."""
+    # A JSON null status is stored as empty, like a missing one
+    status = status or ''
+    if not _check_scalar('temperature', device_id=device_id, status=status):
+        return False
+    ts = _to_epoch(timestamp)
+    return _enqueue('temp', (device_id, temperature, humidity, status, ts))
+
+
+def insert_power_status_log(device_id, ebstatus, dgstatus, timestamp):
+    """Queue a power status log for the writer thread."""
+    if not _check_scalar('power', device_id=device_id):
+        return False
+    ts = _to_epoch(timestamp)
+    return _enqueue('power', (device_id, ebstatus, dgstatus, ts))
+
+
+def insert_fingerprint_log(device_id, user_id, auth_status, timestamp):
+    """Queue a fingerprint authentication log for the writer thread."""
+    if not _check_scalar('fingerprint', device_id=device_id, user_id=user_id,
+                         auth_status=auth_status):
+        return False
+    ts = _to_epoch(timestamp)
+    return _enqueue('fp', (device_id, user_id, auth_status, ts))
 
 
 def get_temperature_logs_by_date(device_id, date):
-    """Retrieve temperature logs for a specific device and date (using created_at for date filtering)."""
-    conn = create_connection()
+    """Retrieve temperature logs for a specific device and date (using created_at for date filtering).
+
+    Rows are yielded in chunks of up to FETCH_CHUNK_SIZE rather than fetched all at once.
+    """
+    conn = get_conn()
     if conn is None:
-        return []
+        return
 
     try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, device_id, temperature, humidity, status, timestamp, created_at
-            FROM temperature_logs
-            WHERE device_id = ? AND DATE(created_at) = ?
-            ORDER BY created_at DESC
-        ''', (device_id, date))
-        
-        return cursor.fetchall()
+        with _lock:
+            cursor = conn.execute('''
+                SELECT temperature, humidity, status, datetime(created_at, 'unixepoch')
+                FROM temperature_logs
+                WHERE device_id = ? AND created_at >= ? AND created_at < ?
+                ORDER BY created_at DESC
+            ''', (device_id, *_day_bounds(date)))
+            while True:
+                rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield rows
     except sqlite3.Error as e:
         print(f"Error retrieving temperature logs: {e}")
-        return []
-    finally:
-        conn.close()
 
 
 def get_power_status_logs_by_date(device_id, date):
-    """Retrieve power status logs for a specific device and date (using created_at for date filtering)."""
-    conn = create_connection()
+    """Retrieve power status logs for a specific device and date (using created_at for date filtering).
+
+    Rows are yielded in chunks of up to FETCH_CHUNK_SIZE rather than fetched all at once.
+    """
+    conn = get_conn()
     if conn is None:
-        return []
+        return
 
     try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, device_id, ebstatus, dgstatus, timestamp, created_at
-            FROM power_status_logs
-            WHERE device_id = ? AND DATE(created_at) = ?
-            ORDER BY created_at DESC
-        ''', (device_id, date))
-        
-        return cursor.fetchall()
+        with _lock:
+            cursor = conn.execute('''
+                SELECT ebstatus, dgstatus, datetime(created_at, 'unixepoch')
+                FROM power_status_logs
+                WHERE device_id = ? AND created_at >= ? AND created_at < ?
+                ORDER BY created_at DESC
+            ''', (device_id, *_day_bounds(date)))
+            while True:
+                rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield rows
     except sqlite3.Error as e:
         print(f"Error retrieving power status logs: {e}")
-        return []
-    finally:
-        conn.close()
 
 
 def get_fingerprint_logs_by_date(device_id, date):
-    """Retrieve fingerprint logs for a specific device and date (using created_at for date filtering)."""
-    conn = create_connection()
+    """Retrieve fingerprint logs for a specific device and date (using created_at for date filtering).
+
+    Rows are yielded in chunks of up to FETCH_CHUNK_SIZE rather than fetched all at once.
+    """
+    conn = get_conn()
     if conn is None:
-        return []
+        return
 
     try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, device_id, user_id, auth_status, timestamp, created_at
-            FROM fingerprint_logs
-            WHERE device_id = ? AND DATE(created_at) = ?
-            ORDER BY created_at DESC
-        ''', (device_id, date))
-        
-        return cursor.fetchall()
+        with _lock:
+            cursor = conn.execute('''
+                SELECT user_id, auth_status, datetime(created_at, 'unixepoch')
+                FROM fingerprint_logs
+                WHERE device_id = ? AND created_at >= ? AND created_at < ?
+                ORDER BY created_at DESC
+            ''', (device_id, *_day_bounds(date)))
+            while True:
+                rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield rows
     except sqlite3.Error as e:
         print(f"Error retrieving fingerprint logs: {e}")
-        return []
-    finally:
-        conn.close()
 
 
 if __name__ == "__main__":
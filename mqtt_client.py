@@ -4,16 +4,17 @@ Connects to MQTT broker, receives data from three device types,
 stores data in SQLite database, and responds to data requests.
 """
 
-import json
+import functools
 import logging
-import time
-import sys
-from datetime import datetime
+import signal
+from datetime import date as _date
+import orjson
 import paho.mqtt.client as mqtt
 
 import config
 from database import (
     init_database,
+    close_database,
     insert_temperature_log,
     insert_power_status_log,
     insert_fingerprint_log,
@@ -34,77 +35,147 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _is_iso_date(date):
+    """Return True if date is a valid date written exactly as YYYY-MM-DD.
+
+    fromisoformat alone also accepts forms like 20260122 and 2026-W04-1 on
+    Python 3.11+, so the parsed date must round-trip to the same string.
+    """
+    try:
+        return _date.fromisoformat(date).isoformat() == date
+    except (TypeError, ValueError):
+        return False
+
+
+@functools.lru_cache(maxsize=256)
+def _response_topic(data_prefix, request_topic):
+    """Build the response topic for a request, cached per requesting client.
+
+    The client ID is the last level of the request topic
+    (e.g., home/gettemp/mqtt_client_1 -> home/datatemp/mqtt_client_1).
+    """
+    client_id = request_topic.split('/')[-1] if '/' in request_topic else config.MQTT_CLIENT_ID
+    return f"{data_prefix}/{client_id}"
+
+
+def _encode_response(device_id, date, chunks):
+    """Encode a response payload incrementally from chunks of records.
+
+    Each chunk (a list of record dicts) is encoded with one orjson call and
+    appended to the buffer, so large result sets are never held as a single
+    list. Returns the payload bytes and the record count; 'count' is written
+    after 'records' since it is only known at the end.
+    """
+    buf = bytearray(orjson.dumps({'device_id': device_id, 'date': date}))
+    buf[-1:] = b',"records":['
+    count = 0
+    for chunk in chunks:
+        if count:
+            buf += b','
+        # Strip the surrounding [] so chunks join into one array
+        buf += orjson.dumps(chunk)[1:-1]
+        count += len(chunk)
+    buf += b'],"count":%d}' % count
+    return bytes(buf), count
+
+
 class MQTTClient:
     """MQTT Client for handling device communications and data storage."""
 
     def __init__(self):
         """Initialize MQTT client."""
-        self.client = mqtt.Client(client_id=config.MQTT_CLIENT_ID)
+        # Persistent session: the broker keeps our subscriptions (and queued
+        # QoS 1 messages) across reconnects, so they need not be re-sent
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=config.MQTT_CLIENT_ID,
+            clean_session=False
+        )
         self.client.on_connect = self.on_connect
+        self.client.on_connect_fail = self.on_connect_fail
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
         self.client.on_publish = self.on_publish
         self.client.on_subscribe = self.on_subscribe
-        self.reconnect_count = 0
         self.is_connected = False
 
-    def on_connect(self, client, userdata, flags, rc):
+        # Topic routing tables: device topics match exactly, request topics
+        # carry the requesting client ID after the prefix
+        self._exact_handlers = {
+            config.TEMPERATURE_DEVICE_TOPIC: self.handle_temperature_data,
+            config.POWER_DEVICE_TOPIC: self.handle_power_status_data,
+            config.FINGERPRINT_DEVICE_TOPIC: self.handle_fingerprint_data,
+        }
+        self._prefix_handlers = (
+            (config.TEMP_REQUEST_TOPIC_PREFIX, self.handle_temperature_request),
+            (config.POWER_REQUEST_TOPIC_PREFIX, self.handle_power_request),
+            (config.FINGERPRINT_REQUEST_TOPIC_PREFIX, self.handle_fingerprint_request),
+        )
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
         """Callback for when the client connects to the broker."""
-        if rc == 0:
+        if not reason_code.is_failure:
             logger.info("Connected to MQTT broker successfully")
             self.is_connected = True
-            self.reconnect_count = 0
-            self.subscribe_to_topics()
+            if flags.session_present:
+                logger.info("Resumed existing session, subscriptions retained by broker")
+            else:
+                self.subscribe_to_topics()
         else:
-            logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
+            logger.error("Failed to connect to MQTT broker. Reason: %s", reason_code)
             self.is_connected = False
 
-    def on_disconnect(self, client, userdata, rc):
+    def on_connect_fail(self, client, userdata):
+        """Callback for when a connection attempt fails; paho retries with backoff."""
+        logger.warning("Connection to MQTT broker failed, retrying")
+
+    def on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
         """Callback for when the client disconnects from the broker."""
         self.is_connected = False
-        if rc != 0:
-            logger.warning(f"Unexpected disconnection. Return code: {rc}")
+        if reason_code.is_failure:
+            logger.warning("Unexpected disconnection. Reason: %s", reason_code)
 
     def on_message(self, client, userdata, msg):
         """Callback for when a message is received."""
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
-            logger.debug(f"Received message on topic {topic}: {payload}")
+            payload = msg.payload
+            # The payload is only decoded to text when it is actually logged
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received message on topic %s: %s", topic,
+                             payload.decode('utf-8', 'replace'))
 
-            # Parse JSON payload
+            # Parse JSON payload straight from the raw bytes
             try:
-                data = json.loads(payload)
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON payload on topic {topic}: {payload}")
+                data = orjson.loads(payload)
+            except orjson.JSONDecodeError:
+                logger.error("Invalid JSON payload on topic %s: %s", topic,
+                             payload.decode('utf-8', 'replace'))
                 return
 
             # Route message based on topic
-            if topic == config.TEMPERATURE_DEVICE_TOPIC:
-                self.handle_temperature_data(data)
-            elif topic == config.POWER_DEVICE_TOPIC:
-                self.handle_power_status_data(data)
-            elif topic == config.FINGERPRINT_DEVICE_TOPIC:
-                self.handle_fingerprint_data(data)
-            elif topic.startswith(config.TEMP_REQUEST_TOPIC_PREFIX):
-                self.handle_temperature_request(data, topic)
-            elif topic.startswith(config.POWER_REQUEST_TOPIC_PREFIX):
-                self.handle_power_request(data, topic)
-            elif topic.startswith(config.FINGERPRINT_REQUEST_TOPIC_PREFIX):
-                self.handle_fingerprint_request(data, topic)
-            else:
-                logger.warning(f"Unknown topic: {topic}")
+            handler = self._exact_handlers.get(topic)
+            if handler is not None:
+                handler(data)
+                return
+
+            # Only the topics in subscribe_to_topics() are delivered, so
+            # anything else never reaches this point
+            for prefix, handler in self._prefix_handlers:
+                if topic.startswith(prefix):
+                    handler(data, topic)
+                    return
 
         except Exception as e:
-            logger.error(f"Error processing message: {e}", exc_info=True)
+            logger.error("Error processing message: %s", e, exc_info=True)
 
-    def on_publish(self, client, userdata, mid):
+    def on_publish(self, client, userdata, mid, reason_code, properties):
         """Callback for when a message is published."""
-        logger.debug(f"Message published with MID: {mid}")
+        logger.debug("Message published with MID: %s", mid)
 
-    def on_subscribe(self, client, userdata, mid, granted_qos):
+    def on_subscribe(self, client, userdata, mid, reason_code_list, properties):
         """Callback for when subscription acknowledgement is received."""
-        logger.debug(f"Subscription acknowledged with QoS: {granted_qos}")
+        logger.debug("Subscription acknowledged with QoS: %s", reason_code_list)
 
     def subscribe_to_topics(self):
         """Subscribe to all required topics."""
@@ -119,29 +190,33 @@ class MQTTClient:
 
         for topic in topics:
             self.client.subscribe(topic, qos=1)
-            logger.info(f"Subscribed to topic: {topic}")
+            logger.info("Subscribed to topic: %s", topic)
 
     def handle_temperature_data(self, data):
         """Handle incoming temperature data from devices."""
         try:
             device_id = data.get('device_id')
-            temperature = float(data.get('temperature'))
-            humidity = float(data.get('humidity'))
+            temperature = data.get('temperature')
+            humidity = data.get('humidity')
             status = data.get('status', '')
             timestamp = data.get('timestamp')
 
-            if not all([device_id, timestamp]) or temperature is None or humidity is None:
-                logger.warning(f"Incomplete temperature data: {data}")
+            # Explicit None checks so 0.0 readings are accepted
+            if device_id is None or temperature is None or humidity is None or timestamp is None:
+                logger.warning("Incomplete temperature data: %s", data)
                 return
 
+            temperature = float(temperature)
+            humidity = float(humidity)
+
             if insert_temperature_log(device_id, temperature, humidity, status, timestamp):
-                logger.info(f"Stored temperature data - Device: {device_id}, "
-                           f"Temp: {temperature}°C, Humidity: {humidity}%")
+                logger.info("Queued temperature data - Device: %s, "
+                           "Temp: %s°C, Humidity: %s%%", device_id, temperature, humidity)
             else:
-                logger.error(f"Failed to store temperature data for device {device_id}")
+                logger.error("Failed to queue temperature data for device %s", device_id)
 
         except Exception as e:
-            logger.error(f"Error handling temperature data: {e}", exc_info=True)
+            logger.error("Error handling temperature data: %s", e, exc_info=True)
 
     def handle_power_status_data(self, data):
         """Handle incoming power status data from devices.
@@ -154,8 +229,8 @@ class MQTTClient:
             status = data.get('status', '')
             timestamp = data.get('timestamp')
 
-            if not all([device_id, status, timestamp]):
-                logger.warning(f"Incomplete power status data: {data}")
+            if device_id is None or not status or timestamp is None:
+                logger.warning("Incomplete power status data: %s", data)
                 return
 
             # Parse combined status into individual EB/DG values
@@ -167,12 +242,12 @@ class MQTTClient:
                 dgstatus = status.replace('DG_', '')
 
             if insert_power_status_log(device_id, ebstatus, dgstatus, timestamp):
-                logger.info(f"Stored power status - Device: {device_id}, Status: {status}")
+                logger.info("Queued power status - Device: %s, Status: %s", device_id, status)
             else:
-                logger.error(f"Failed to store power status for device {device_id}")
+                logger.error("Failed to queue power status for device %s", device_id)
 
         except Exception as e:
-            logger.error(f"Error handling power status data: {e}", exc_info=True)
+            logger.error("Error handling power status data: %s", e, exc_info=True)
 
     def handle_fingerprint_data(self, data):
         """Handle incoming fingerprint authentication data from devices.
@@ -185,18 +260,18 @@ class MQTTClient:
             auth_status = data.get('authStatus')
             timestamp = data.get('timestamp')
 
-            if not all([device_id, user_id, auth_status, timestamp]):
-                logger.warning(f"Incomplete fingerprint data: {data}")
+            if device_id is None or user_id is None or auth_status is None or timestamp is None:
+                logger.warning("Incomplete fingerprint data: %s", data)
                 return
 
             if insert_fingerprint_log(device_id, user_id, auth_status, timestamp):
-                logger.info(f"Stored fingerprint auth - Device: {device_id}, "
-                           f"User: {user_id}, Status: {auth_status}")
+                logger.info("Queued fingerprint auth - Device: %s, "
+                           "User: %s, Status: %s", device_id, user_id, auth_status)
             else:
-                logger.error(f"Failed to store fingerprint data for device {device_id}")
+                logger.error("Failed to queue fingerprint data for device %s", device_id)
 
         except Exception as e:
-            logger.error(f"Error handling fingerprint data: {e}", exc_info=True)
+            logger.error("Error handling fingerprint data: %s", e, exc_info=True)
 
     def handle_temperature_request(self, request_data, request_topic):
         """Handle temperature data requests from mobile app."""
@@ -205,49 +280,35 @@ class MQTTClient:
             date = request_data.get('date')
 
             if not device_id or not date:
-                logger.warning(f"Incomplete request data: {request_data}")
+                logger.warning("Incomplete request data: %s", request_data)
                 return
 
-            # Extract client ID from request topic (e.g., home/gettemp/mqtt_client_1)
-            client_id = request_topic.split('/')[-1] if '/' in request_topic else config.MQTT_CLIENT_ID
-            logger.info(f"Requested temperature data on {request_topic}: {request_data}")
+            logger.info("Requested temperature data on %s: %s", request_topic, request_data)
 
             # Validate date format (YYYY-MM-DD)
-            try:
-                datetime.strptime(date, '%Y-%m-%d')
-            except ValueError:
-                logger.warning(f"Invalid date format: {date}. Expected YYYY-MM-DD")
+            if not _is_iso_date(date):
+                logger.warning("Invalid date format: %s. Expected YYYY-MM-DD", date)
                 return
 
             # Retrieve temperature logs for the requested date
             logs = get_temperature_logs_by_date(device_id, date)
 
-            # Format response
-            response_data = {
-                'device_id': device_id,
-                'date': date,
-                'count': len(logs),
-                'records': []
-            }
-
-            for log in logs:
-                response_data['records'].append({
-                    'temperature': log['temperature'],
-                    'humidity': log['humidity'],
-                    'status': log['status'],
-                    'timestamp': log['created_at']
-                })
+            # Format response, encoding records chunk by chunk as they are read
+            response_payload, count = _encode_response(device_id, date, (
+                [{'temperature': t, 'humidity': h, 'status': st, 'timestamp': ts}
+                 for t, h, st, ts in rows]
+                for rows in logs
+            ))
 
             # Publish response on the datatemp topic with the requesting client's ID
-            response_topic = f"{config.TEMP_DATA_TOPIC_PREFIX}/{client_id}"
-            response_payload = json.dumps(response_data)
+            response_topic = _response_topic(config.TEMP_DATA_TOPIC_PREFIX, request_topic)
 
             self.client.publish(response_topic, response_payload, qos=1)
-            logger.info(f"Published temperature data response on {response_topic} - "
-                       f"Records: {len(logs)}")
+            logger.info("Published temperature data response on %s - "
+                       "Records: %s", response_topic, count)
 
         except Exception as e:
-            logger.error(f"Error handling temperature request: {e}", exc_info=True)
+            logger.error("Error handling temperature request: %s", e, exc_info=True)
 
     def handle_power_request(self, request_data, request_topic):
         """Handle power status data requests from mobile app."""
@@ -256,42 +317,29 @@ class MQTTClient:
             date = request_data.get('date')
 
             if not device_id or not date:
-                logger.warning(f"Incomplete power request data: {request_data}")
+                logger.warning("Incomplete power request data: %s", request_data)
                 return
 
-            # Extract client ID from request topic
-            client_id = request_topic.split('/')[-1] if '/' in request_topic else config.MQTT_CLIENT_ID
-            logger.info(f"Requested power data on {request_topic}: {request_data}")
+            logger.info("Requested power data on %s: %s", request_topic, request_data)
 
-            try:
-                datetime.strptime(date, '%Y-%m-%d')
-            except ValueError:
-                logger.warning(f"Invalid date format: {date}. Expected YYYY-MM-DD")
+            if not _is_iso_date(date):
+                logger.warning("Invalid date format: %s. Expected YYYY-MM-DD", date)
                 return
 
             logs = get_power_status_logs_by_date(device_id, date)
 
-            response_data = {
-                'device_id': device_id,
-                'date': date,
-                'count': len(logs),
-                'records': []
-            }
-
-            for log in logs:
-                response_data['records'].append({
-                    'ebstatus': log['ebstatus'],
-                    'dgstatus': log['dgstatus'],
-                    'timestamp': log['created_at']
-                })
-
-            response_topic = f"{config.POWER_DATA_TOPIC_PREFIX}/{client_id}"
-            response_payload = json.dumps(response_data)
+            response_payload, count = _encode_response(device_id, date, (
+                [{'ebstatus': eb, 'dgstatus': dg, 'timestamp': ts}
+                 for eb, dg, ts in rows]
+                for rows in logs
+            ))
+
+            response_topic = _response_topic(config.POWER_DATA_TOPIC_PREFIX, request_topic)
             self.client.publish(response_topic, response_payload, qos=1)
-            logger.info(f"Published power status data on {response_topic} - Records: {len(logs)}")
+            logger.info("Published power status data on %s - Records: %s", response_topic, count)
 
         except Exception as e:
-            logger.error(f"Error handling power request: {e}", exc_info=True)
+            logger.error("Error handling power request: %s", e, exc_info=True)
 
     def handle_fingerprint_request(self, request_data, request_topic):
         """Handle fingerprint authentication data requests from mobile app."""
@@ -300,77 +348,49 @@ class MQTTClient:
             date = request_data.get('date')
 
             if not device_id or not date:
-                logger.warning(f"Incomplete fingerprint request data: {request_data}")
+                logger.warning("Incomplete fingerprint request data: %s", request_data)
                 return
 
-            # Extract client ID from request topic
-            client_id = request_topic.split('/')[-1] if '/' in request_topic else config.MQTT_CLIENT_ID
-            logger.info(f"Requested fingerprint data on {request_topic}: {request_data}")
+            logger.info("Requested fingerprint data on %s: %s", request_topic, request_data)
 
-            try:
-                datetime.strptime(date, '%Y-%m-%d')
-            except ValueError:
-                logger.warning(f"Invalid date format: {date}. Expected YYYY-MM-DD")
+            if not _is_iso_date(date):
+                logger.warning("Invalid date format: %s. Expected YYYY-MM-DD", date)
                 return
 
             logs = get_fingerprint_logs_by_date(device_id, date)
 
-            response_data = {
-                'device_id': device_id,
-                'date': date,
-                'count': len(logs),
-                'records': []
-            }
-
-            for log in logs:
-                response_data['records'].append({
-                    'user_id': log['user_id'],
-                    'authStatus': log['auth_status'],
-                    'timestamp': log['created_at']
-                })
-
-            response_topic = f"{config.FINGERPRINT_DATA_TOPIC_PREFIX}/{client_id}"
-            response_payload = json.dumps(response_data)
+            response_payload, count = _encode_response(device_id, date, (
+                [{'user_id': user_id, 'authStatus': auth_status, 'timestamp': ts}
+                 for user_id, auth_status, ts in rows]
+                for rows in logs
+            ))
+
+            response_topic = _response_topic(config.FINGERPRINT_DATA_TOPIC_PREFIX, request_topic)
             self.client.publish(response_topic, response_payload, qos=1)
-            logger.info(f"Published fingerprint data on {response_topic} - Records: {len(logs)}")
+            logger.info("Published fingerprint data on %s - Records: %s", response_topic, count)
 
         except Exception as e:
-            logger.error(f"Error handling fingerprint request: {e}", exc_info=True)
+            logger.error("Error handling fingerprint request: %s", e, exc_info=True)
 
     def connect(self):
-        """Connect to MQTT broker with reconnection logic."""
-        try:
-            # Set username and password if configured
-            if config.MQTT_USERNAME and config.MQTT_PASSWORD:
-                self.client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
-
-            # Connect to broker
-            self.client.connect(
-                config.MQTT_BROKER_HOST,
-                config.MQTT_BROKER_PORT,
-                keepalive=config.MQTT_KEEPALIVE
-            )
-
-            # Start network loop
-            self.client.loop_start()
-            logger.info(f"Connecting to MQTT broker at {config.MQTT_BROKER_HOST}:"
-                       f"{config.MQTT_BROKER_PORT}")
-
-        except Exception as e:
-            logger.error(f"Connection error: {e}", exc_info=True)
-            self.reconnect()
-
-    def reconnect(self):
-        """Attempt to reconnect to broker with exponential backoff."""
-        if self.reconnect_count < config.MAX_RECONNECT_ATTEMPTS:
-            self.reconnect_count += 1
-            delay = config.RECONNECT_DELAY * (2 ** (self.reconnect_count - 1))
-            logger.warning(f"Reconnection attempt {self.reconnect_count} in {delay} seconds")
-            time.sleep(delay)
-            self.connect()
-        else:
-            logger.error("Max reconnection attempts reached. Exiting.")
-            sys.exit(1)
+        """Configure the broker connection; the network loop in run() opens it."""
+        # Set username and password if configured
+        if config.MQTT_USERNAME and config.MQTT_PASSWORD:
+            self.client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
+
+        # Paho retries failed connections with exponential backoff
+        self.client.reconnect_delay_set(
+            min_delay=config.RECONNECT_DELAY,
+            max_delay=config.MAX_RECONNECT_DELAY
+        )
+
+        self.client.connect_async(
+            config.MQTT_BROKER_HOST,
+            config.MQTT_BROKER_PORT,
+            keepalive=config.MQTT_KEEPALIVE
+        )
+        logger.info("Connecting to MQTT broker at %s:%s",
+                    config.MQTT_BROKER_HOST, config.MQTT_BROKER_PORT)
 
     def run(self):
         """Start the MQTT client and keep it running."""
@@ -379,26 +399,33 @@ class MQTTClient:
             init_database()
             logger.info("Database initialized")
 
-            # Connect to broker
-            self.connect()
+            # systemd stops the service with SIGTERM; turn it into a clean
+            # disconnect so loop_forever() returns and queued rows are flushed
+            signal.signal(signal.SIGTERM, self.handle_sigterm)
 
-            # Keep the client running
-            while True:
-                time.sleep(1)
+            # Connect to broker and run the network loop in this thread
+            self.connect()
+            self.client.loop_forever(retry_first_connection=True)
 
         except KeyboardInterrupt:
             logger.info("Keyboard interrupt received. Shutting down.")
         except Exception as e:
-            logger.error(f"Unexpected error: {e}", exc_info=True)
+            logger.error("Unexpected error: %s", e, exc_info=True)
         finally:
             self.shutdown()
 
+    def handle_sigterm(self, signum, frame):
+        """Signal handler for SIGTERM: end the network loop so run() shuts down."""
+        logger.info("SIGTERM received. Shutting down.")
+        self.client.disconnect()
+
     def shutdown(self):
         """Gracefully shutdown the MQTT client."""
         logger.info("Shutting down MQTT client")
-        self.client.loop_stop()
         self.client.disconnect()
         logger.info("MQTT client disconnected")
+        close_database()
+        logger.info("Database writer stopped")
 
 
 def main():
@@ -7,13 +7,20 @@ results to stdout for local testing.
 """
 
 import os
-import json
 import time
+import heapq
 import random
-import argparse
-from datetime import datetime, date
+import selectors
+import socket
+import sys
+from array import array
+from datetime import date
+from types import SimpleNamespace
 import logging
+import orjson
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
 import config
 
@@ -24,11 +31,114 @@ logging.basicConfig(
 )
 logger = logging.getLogger('test_client')
 
+# Number of temperature/humidity samples generated per refill of the pool
+SAMPLE_POOL_SIZE = 4096
+
+# The scheduler keeps time as integer nanoseconds from time.monotonic_ns()
+NS_PER_SEC = 1_000_000_000
+
+# Minimum idle time before the next scheduled publish that a pending request
+# burst needs before it is sent, so it never delays a telemetry publish
+REQUEST_IDLE_GUARD_NS = 50_000_000  # 50 ms
+
+# Longest the selector may block, so loop_misc() keeps the connection alive
+MAX_SELECT_NS = NS_PER_SEC
+
+# Linux-only socket option that holds partial segments until uncorked
+_TCP_CORK = getattr(socket, 'TCP_CORK', None)
+
+# Telemetry topics in topic-alias order: alias n + 1 maps TELEMETRY_TOPICS[n]
+TELEMETRY_TOPICS = (
+    config.TEMPERATURE_DEVICE_TOPIC,
+    config.POWER_DEVICE_TOPIC,
+    config.FINGERPRINT_DEVICE_TOPIC,
+)
+
+# Lookup tables for the categorical telemetry fields, indexed by random bits
+_TEMP_STATUSES = (b'HIGH', b'LOW')
+_POWER_STATUSES = (b'DG_ON', b'DG_OFF', b'EB_ON', b'EB_OFF')
+_AUTH_STATUSES = (b'PASS', b'FAIL')
+
+# Encoded fingerprint user id suffixes (user_100 .. user_999)
+_USER_IDS = tuple(b'%d' % n for n in range(100, 1000))
+
+# Last formatted second and its ISO timestamp; payloads only carry 1 s resolution
+_ts_cache = [0, b""]
+
+
+def _iso_ts():
+    """Return the current UTC time as ISO bytes, reformatting at most once a second."""
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache[0] = now
+        _ts_cache[1] = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)).encode()
+    return _ts_cache[1]
+
+
+def _tune_scheduling():
+    """Optionally pin the process to one CPU and raise its priority.
+
+    Both are opt-in through TEST_CLIENT_CPU and TEST_CLIENT_NICE (a negative
+    nice increment, which needs CAP_SYS_NICE). The client runs on a single
+    thread, so pinning the process covers the scheduler and network loop.
+    """
+    cpu = os.getenv('TEST_CLIENT_CPU')
+    if cpu:
+        try:
+            os.sched_setaffinity(0, {int(cpu)})
+            logger.info("Pinned test client to CPU %s", cpu)
+        except (AttributeError, ValueError, OSError) as e:
+            logger.warning("Could not pin test client to CPU %s: %s", cpu, e)
+    nice = os.getenv('TEST_CLIENT_NICE')
+    if nice:
+        try:
+            os.nice(int(nice))
+        except (ValueError, OSError) as e:
+            logger.warning("Could not change test client priority by %s: %s", nice, e)
+
+
+def _defer_write(client, userdata, sock):
+    """on_socket_register_write hook that leaves queued packets for loop_write()."""
+
+
+def _alias_props(alias):
+    """Build the PUBLISH properties carrying one topic alias."""
+    props = Properties(PacketTypes.PUBLISH)
+    props.TopicAlias = alias
+    return props
+
+
+def _temp_samples():
+    """Preformat a batch of temperature/humidity payload fragments.
+
+    All the randomness comes from one getrandbits() call: each pair of 32-bit
+    values is mapped to hundredths within 18-30 C and 30-70 % humidity. The
+    draws are wide enough that the modulo bias is negligible.
+    """
+    nbytes = 8 * SAMPLE_POOL_SIZE
+    raw = array('I', random.getrandbits(8 * nbytes).to_bytes(nbytes, 'little'))
+    return [
+        b'%d.%02d,"humidity":%d.%02d' % (*divmod(1800 + t % 1201, 100), *divmod(3000 + h % 4001, 100))
+        for t, h in zip(raw[::2], raw[1::2])
+    ]
+
 
 class TestMQTTClient:
+    # Fixed attribute set: no per-instance __dict__ and cheaper attribute
+    # loads on the publish path
+    __slots__ = (
+        'broker_host', 'broker_port', 'target_client_id', 'client_id',
+        'temp_device_id', 'power_device_id', 'fingerprint_device_id', 'request_date',
+        '_temp_buf', '_power_buf', '_fp_buf',
+        '_temp_prefix_len', '_power_prefix_len', '_fp_prefix_len',
+        '_temp_pool', '_alias_props', '_routes', '_requests_due',
+        '_temp_req_topic', '_power_req_topic', '_fp_req_topic',
+        'client', '_sel', '_next_reconnect',
+    )
+
     def __init__(self, broker_host, broker_port, target_client_id, client_id,
                  temp_device_id, power_device_id, fingerprint_device_id,
-                 request_date):
+                 request_date, mqtt_v5=True):
         self.broker_host = broker_host
         self.broker_port = broker_port
         self.target_client_id = target_client_id  # The server/client we are testing
@@ -38,152 +148,347 @@ class TestMQTTClient:
         self.fingerprint_device_id = fingerprint_device_id
         self.request_date = request_date
 
-        self.client = mqtt.Client(client_id=self.client_id)
+        # Reusable payload buffers, each starting with the constant leading
+        # part of its telemetry payload; publishes truncate back to the prefix
+        self._temp_buf = bytearray(b'{"device_id":%s,"temperature":' % orjson.dumps(temp_device_id))
+        self._power_buf = bytearray(b'{"device_id":%s,"status":"' % orjson.dumps(power_device_id))
+        self._fp_buf = bytearray(b'{"device_id":%s,"user_id":"user_' % orjson.dumps(fingerprint_device_id))
+        self._temp_prefix_len = len(self._temp_buf)
+        self._power_prefix_len = len(self._power_buf)
+        self._fp_prefix_len = len(self._fp_buf)
+
+        # Pool of preformatted temperature/humidity fragments, consumed by pop()
+        self._temp_pool = []
+
+        # Per-telemetry-topic (topic, properties) for the next publish. Until an
+        # alias is registered with the broker this is the full topic and no
+        # properties; afterwards an empty topic and the alias.
+        self._alias_props = [_alias_props(n + 1) for n in range(len(TELEMETRY_TOPICS))]
+        self._routes = [(topic, None) for topic in TELEMETRY_TOPICS]
+
+        # Set by the scheduler when a request burst is due; the burst itself is
+        # sent from the network loop once there is idle time for it
+        self._requests_due = False
+
+        # Request topics for the target server client, built once
+        self._temp_req_topic = f"{config.TEMP_REQUEST_TOPIC_PREFIX}/{target_client_id}"
+        self._power_req_topic = f"{config.POWER_REQUEST_TOPIC_PREFIX}/{target_client_id}"
+        self._fp_req_topic = f"{config.FINGERPRINT_REQUEST_TOPIC_PREFIX}/{target_client_id}"
+
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=self.client_id,
+            protocol=mqtt.MQTTv5 if mqtt_v5 else mqtt.MQTTv311,
+        )
         if config.MQTT_USERNAME and config.MQTT_PASSWORD:
             self.client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
 
+        # The client socket is watched by this selector from run(); paho
+        # reports the socket coming and going across reconnects
+        self._sel = selectors.DefaultSelector()
+        # monotonic_ns time before which no reconnect is attempted
+        self._next_reconnect = 0
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
 
-    def on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if not reason_code.is_failure:
             logger.info('Test client connected to broker')
+            # Aliases do not survive a reconnect: start over with full topics,
+            # and only use aliases if the broker accepts enough of them
+            alias_max = getattr(properties, 'TopicAliasMaximum', 0) if properties else 0
+            use_aliases = alias_max >= len(TELEMETRY_TOPICS)
+            self._routes = [
+                (topic, props if use_aliases else None)
+                for topic, props in zip(TELEMETRY_TOPICS, self._alias_props)
+            ]
+            if use_aliases:
+                logger.info("Using topic aliases (broker maximum %s)", alias_max)
             # Subscribe to response topics for the target server client
             topics = [
                 f"{config.TEMP_DATA_TOPIC_PREFIX}/{self.target_client_id}",
                 f"{config.POWER_DATA_TOPIC_PREFIX}/{self.target_client_id}",
                 f"{config.FINGERPRINT_DATA_TOPIC_PREFIX}/{self.target_client_id}",
             ]
+            # One SUBSCRIBE packet (and one SUBACK) covers all three topics
+            client.subscribe([(t, 1) for t in topics])
             for t in topics:
-                client.subscribe(t, qos=1)
-                logger.info(f"Subscribed to response topic: {t}")
+                logger.info("Subscribed to response topic: %s", t)
         else:
-            logger.error(f"Connect failed with rc={rc}")
+            logger.error("Connect failed with rc=%s", reason_code)
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties):
+        logger.warning("Disconnected with rc=%s", reason_code)
 
-    def on_disconnect(self, client, userdata, rc):
-        logger.warning(f"Disconnected with rc={rc}")
+    def on_socket_open(self, client, userdata, sock):
+        self._sel.register(sock, selectors.EVENT_READ)
+
+    def on_socket_close(self, client, userdata, sock):
+        self._sel.unregister(sock)
+        # Aliases die with the connection; until the next CONNACK decides
+        # whether to use them again, publishes must carry the full topic
+        self._routes = [(topic, None) for topic in TELEMETRY_TOPICS]
 
     def on_message(self, client, userdata, msg):
         try:
-            payload = msg.payload.decode('utf-8')
-            logger.info(f"Response on {msg.topic}: {payload}")
+            # Decoding the payload is only worth it if the line is emitted
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Response on %s: %s", msg.topic, msg.payload.decode('utf-8'))
         except Exception as e:
-            logger.error(f"Error decoding response: {e}")
+            logger.error("Error decoding response: %s", e)
 
     def connect(self):
         self.client.connect(self.broker_host, self.broker_port, keepalive=config.MQTT_KEEPALIVE)
-        self.client.loop_start()
-        logger.info(f"Connecting to {self.broker_host}:{self.broker_port}")
+        logger.info("Connecting to %s:%s", self.broker_host, self.broker_port)
 
     def shutdown(self):
-        self.client.loop_stop()
         self.client.disconnect()
         logger.info("Test client disconnected")
 
+    def _publish_telemetry(self, slot, payload):
+        """Publish a telemetry payload at QoS 0 on TELEMETRY_TOPICS[slot].
+
+        The first publish with an alias sends the full topic to register it;
+        once that went out, later publishes send an empty topic instead.
+        """
+        routes = self._routes
+        topic, props = routes[slot]
+        info = self.client.publish(topic, payload, qos=0, properties=props)
+        if topic and props is not None and info.rc == mqtt.MQTT_ERR_SUCCESS:
+            routes[slot] = ('', props)
+
     # --- Publishers ---
+    # Each payload is assembled in a bytearray reused across publishes: the
+    # buffer is cut back to its precomputed prefix and the variable fields are
+    # appended from pooled or constant bytes, so no dict, JSON encoder walk or
+    # fresh payload object is needed per publish. paho copies QoS 0 payloads
+    # into the outgoing packet, so the buffer is free again once publish()
+    # returns. Telemetry is sent at QoS 0: a lost reading is superseded by the
+    # next one anyway.
     def publish_temperature(self):
-        payload = {
-            'device_id': self.temp_device_id,
-            'temperature': round(random.uniform(18.0, 30.0), 2),
-            'humidity': round(random.uniform(30.0, 70.0), 2),
-            'status': random.choice(['HIGH', 'LOW']),
-            'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
-        }
-        self.client.publish(config.TEMPERATURE_DEVICE_TOPIC, json.dumps(payload), qos=1)
+        pool = self._temp_pool
+        if not pool:
+            pool.extend(_temp_samples())
+        buf = self._temp_buf
+        del buf[self._temp_prefix_len:]
+        buf += pool.pop()
+        buf += b',"status":"'
+        buf += _TEMP_STATUSES[random.getrandbits(1)]
+        buf += b'","timestamp":"'
+        buf += _iso_ts()
+        buf += b'"}'
+        self._publish_telemetry(0, buf)
 
     def publish_power(self):
-        status = random.choice(['DG_ON', 'DG_OFF', 'EB_ON', 'EB_OFF'])
-        payload = {
-            'device_id': self.power_device_id,
-            'status': status,
-            'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
-        }
-        self.client.publish(config.POWER_DEVICE_TOPIC, json.dumps(payload), qos=1)
+        buf = self._power_buf
+        del buf[self._power_prefix_len:]
+        buf += _POWER_STATUSES[random.getrandbits(2)]
+        buf += b'","timestamp":"'
+        buf += _iso_ts()
+        buf += b'"}'
+        self._publish_telemetry(1, buf)
 
     def publish_fingerprint(self):
-        user_id = f"user_{random.randint(100, 999)}"
-        auth_status = random.choice(['PASS', 'FAIL'])
-        payload = {
-            'device_id': self.fingerprint_device_id,
-            'user_id': user_id,
-            'authStatus': auth_status,
-            'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
-        }
-        self.client.publish(config.FINGERPRINT_DEVICE_TOPIC, json.dumps(payload), qos=1)
+        # One draw covers both fields: low bit for auth status, the other 31 bits
+        # for the user id (wide enough that the modulo bias is negligible)
+        bits = random.getrandbits(32)
+        buf = self._fp_buf
+        del buf[self._fp_prefix_len:]
+        buf += _USER_IDS[(bits >> 1) % 900]
+        buf += b'","authStatus":"'
+        buf += _AUTH_STATUSES[bits & 1]
+        buf += b'","timestamp":"'
+        buf += _iso_ts()
+        buf += b'"}'
+        self._publish_telemetry(2, buf)
 
     # --- Requesters ---
     def request_temperature(self):
-        topic = f"{config.TEMP_REQUEST_TOPIC_PREFIX}/{self.target_client_id}"
+        topic = self._temp_req_topic
         payload = {
             'device_id': self.temp_device_id,
             'date': self.request_date
         }
-        self.client.publish(topic, json.dumps(payload), qos=1)
-        logger.info(f"Requested temperature data on {topic}: {payload}")
+        self.client.publish(topic, orjson.dumps(payload), qos=1)
+        logger.info("Requested temperature data on %s: %s", topic, payload)
 
     def request_power(self):
-        topic = f"{config.POWER_REQUEST_TOPIC_PREFIX}/{self.target_client_id}"
+        topic = self._power_req_topic
         payload = {
             'device_id': self.power_device_id,
             'date': self.request_date
         }
-        self.client.publish(topic, json.dumps(payload), qos=1)
-        logger.info(f"Requested power data on {topic}: {payload}")
+        self.client.publish(topic, orjson.dumps(payload), qos=1)
+        logger.info("Requested power data on %s: %s", topic, payload)
 
     def request_fingerprint(self):
-        topic = f"{config.FINGERPRINT_REQUEST_TOPIC_PREFIX}/{self.target_client_id}"
+        topic = self._fp_req_topic
         payload = {
             'device_id': self.fingerprint_device_id,
             'date': self.request_date
         }
-        self.client.publish(topic, json.dumps(payload), qos=1)
-        logger.info(f"Requested fingerprint data on {topic}: {payload}")
+        self.client.publish(topic, orjson.dumps(payload), qos=1)
+        logger.info("Requested fingerprint data on %s: %s", topic, payload)
+
+    def _service_network(self, deadline):
+        """Service the MQTT socket in this thread until the monotonic_ns deadline.
+
+        There is no background loop thread and no paho loop() call, so paho
+        never creates its wake-up socketpair: the selector waits on the client
+        socket alone and loop_read/loop_write/loop_misc are driven from here.
+        Publishes, PUBACKs, responses and keepalives are all handled between
+        scheduled tasks.
+        """
+        # Hot loop: bind everything looked up per iteration to locals
+        client = self.client
+        sel = self._sel
+        select = sel.select
+        monotonic_ns = time.monotonic_ns
+        EVENT_READ = selectors.EVENT_READ
+        EVENT_WRITE = selectors.EVENT_WRITE
+        while True:
+            delay = deadline - monotonic_ns()
+            if delay <= 0:
+                return
+            if self._requests_due and delay > REQUEST_IDLE_GUARD_NS:
+                self._requests_due = False
+                self.request_all()
+                continue
+            sock = client.socket()
+            if sock is not None:
+                # Only ask for writability while paho has output left over
+                want = EVENT_READ
+                if client.want_write():
+                    want |= EVENT_WRITE
+                if sel.get_key(sock).events != want:
+                    sel.modify(sock, want)
+                rc = mqtt.MQTT_ERR_SUCCESS
+                for _, events in select(min(delay, MAX_SELECT_NS) / NS_PER_SEC):
+                    if events & EVENT_READ:
+                        rc = client.loop_read()
+                    if not rc and events & EVENT_WRITE:
+                        rc = client.loop_write()
+                if not rc:
+                    rc = client.loop_misc()
+                if not rc:
+                    continue
+            # Connection lost: retry at most every RECONNECT_DELAY seconds
+            now = monotonic_ns()
+            if now >= self._next_reconnect:
+                self._next_reconnect = now + config.RECONNECT_DELAY * NS_PER_SEC
+                try:
+                    client.reconnect()
+                    continue
+                except OSError as e:
+                    logger.warning("Reconnect failed: %s", e)
+            time.sleep(max(0, min(deadline, self._next_reconnect) - monotonic_ns()) / NS_PER_SEC)
+
+    def request_all(self):
+        """Request all three data types for the same date in one write pass.
+
+        While the write hook is set, publish() only queues its packet instead
+        of writing it straight away; a single loop_write() then flushes the
+        whole burst back to back. On Linux the socket is corked for the flush
+        so the three PUBLISH packets leave in as few TCP segments as possible.
+        """
+        client = self.client
+        client.on_socket_register_write = _defer_write
+        try:
+            self.request_temperature()
+            self.request_power()
+            self.request_fingerprint()
+        finally:
+            client.on_socket_register_write = None
+
+        sock = client.socket()
+        if sock is None or _TCP_CORK is None:
+            client.loop_write()
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, _TCP_CORK, 1)
+            try:
+                client.loop_write()
+            finally:
+                sock.setsockopt(socket.IPPROTO_TCP, _TCP_CORK, 0)
+        except OSError as e:
+            # The socket went away mid-burst; the network loop reconnects
+            logger.warning("Request burst on a closed socket: %s", e)
+
+    def mark_requests_due(self):
+        """Scheduled task for the request burst: flag it for the next idle gap."""
+        self._requests_due = True
 
     def run(self):
         try:
+            _tune_scheduling()
             self.connect()
-            temp_interval = int(os.getenv('TEMP_INTERVAL', '5'))
-            power_interval = int(os.getenv('POWER_INTERVAL', '15'))
-            fingerprint_interval = int(os.getenv('FINGERPRINT_INTERVAL', '20'))
-            request_interval = int(os.getenv('REQUEST_INTERVAL', '300'))
+            temp_interval = int(os.getenv('TEMP_INTERVAL', '5')) * NS_PER_SEC
+            power_interval = int(os.getenv('POWER_INTERVAL', '15')) * NS_PER_SEC
+            fingerprint_interval = int(os.getenv('FINGERPRINT_INTERVAL', '20')) * NS_PER_SEC
+            request_interval = int(os.getenv('REQUEST_INTERVAL', '300')) * NS_PER_SEC
 
-            last_temp = last_power = last_fp = last_req = 0
+            # Deadline heap of (next_run, order, interval, task); between tasks
+            # the network loop runs until exactly the next one is due
+            now = time.monotonic_ns()
+            schedule = [
+                (now, 0, temp_interval, self.publish_temperature),
+                (now, 1, power_interval, self.publish_power),
+                (now, 2, fingerprint_interval, self.publish_fingerprint),
+                (now, 3, request_interval, self.mark_requests_due),
+            ]
+            heapq.heapify(schedule)
 
+            service = self._service_network
+            heapreplace = heapq.heapreplace
             while True:
-                now = time.time()
-                if now - last_temp >= temp_interval:
-                    self.publish_temperature()
-                    last_temp = now
-                if now - last_power >= power_interval:
-                    self.publish_power()
-                    last_power = now
-                if now - last_fp >= fingerprint_interval:
-                    self.publish_fingerprint()
-                    last_fp = now
-                if now - last_req >= request_interval:
-                    # Request all three types for the same date
-                    self.request_temperature()
-                    self.request_power()
-                    self.request_fingerprint()
-                    last_req = now
-                time.sleep(0.5)
+                deadline, order, interval, task = schedule[0]
+                service(deadline)
+                task()
+                heapreplace(schedule, (deadline + interval, order, interval, task))
         except KeyboardInterrupt:
             logger.info("Interrupted by user")
         finally:
             self.shutdown()
 
 
+def _env_defaults():
+    """Option values taken from the environment, used when no flag overrides them."""
+    return {
+        'broker_host': os.getenv('MQTT_BROKER_HOST', config.MQTT_BROKER_HOST),
+        'broker_port': int(os.getenv('MQTT_BROKER_PORT', config.MQTT_BROKER_PORT)),
+        'target_client_id': os.getenv('TARGET_CLIENT_ID', config.MQTT_CLIENT_ID),
+        'client_id': os.getenv('TEST_CLIENT_ID', 'mqtt_tester_1'),
+        'temp_device_id': os.getenv('TEMP_DEVICE_ID', 'temp_sensor_01'),
+        'power_device_id': os.getenv('POWER_DEVICE_ID', 'power_switch_01'),
+        'fingerprint_device_id': os.getenv('FP_DEVICE_ID', 'fingerprint_01'),
+        'mqtt_v311': os.getenv('TEST_MQTT_V311', '').lower() in ('1', 'true', 'yes'),
+        'date': os.getenv('REQUEST_DATE', date.today().strftime('%Y-%m-%d')),
+    }
+
+
 def parse_args():
+    defaults = _env_defaults()
+    # Without command-line flags the environment is all there is to read, so
+    # argparse is only imported and built when flags are actually given
+    if len(sys.argv) == 1:
+        return SimpleNamespace(**defaults)
+
+    import argparse
     parser = argparse.ArgumentParser(description='Local MQTT Test Client')
-    parser.add_argument('--broker-host', default=os.getenv('MQTT_BROKER_HOST', config.MQTT_BROKER_HOST), help='MQTT broker host')
-    parser.add_argument('--broker-port', type=int, default=int(os.getenv('MQTT_BROKER_PORT', config.MQTT_BROKER_PORT)), help='MQTT broker port')
-    parser.add_argument('--target-client-id', default=os.getenv('TARGET_CLIENT_ID', config.MQTT_CLIENT_ID), help='Target server client ID to request from')
-    parser.add_argument('--client-id', default=os.getenv('TEST_CLIENT_ID', 'mqtt_tester_1'), help='This test client ID')
-    parser.add_argument('--temp-device-id', default=os.getenv('TEMP_DEVICE_ID', 'temp_sensor_01'))
-    parser.add_argument('--power-device-id', default=os.getenv('POWER_DEVICE_ID', 'power_switch_01'))
-    parser.add_argument('--fingerprint-device-id', default=os.getenv('FP_DEVICE_ID', 'fingerprint_01'))
-    parser.add_argument('--date', default=os.getenv('REQUEST_DATE', date.today().strftime('%Y-%m-%d')), help='Date (YYYY-MM-DD) to request')
+    parser.add_argument('--broker-host', help='MQTT broker host')
+    parser.add_argument('--broker-port', type=int, help='MQTT broker port')
+    parser.add_argument('--target-client-id', help='Target server client ID to request from')
+    parser.add_argument('--client-id', help='This test client ID')
+    parser.add_argument('--temp-device-id')
+    parser.add_argument('--power-device-id')
+    parser.add_argument('--fingerprint-device-id')
+    parser.add_argument('--mqtt-v311', action='store_true',
+                        help='Connect with MQTT 3.1.1 (no topic aliases) for brokers without MQTT 5')
+    parser.add_argument('--date', help='Date (YYYY-MM-DD) to request')
+    parser.set_defaults(**defaults)
     return parser.parse_args()
 
 
@@ -198,5 +503,6 @@ if __name__ == '__main__':
         power_device_id=args.power_device_id,
         fingerprint_device_id=args.fingerprint_device_id,
         request_date=args.date,
+        mqtt_v5=not args.mqtt_v311,
     )
     tester.run()